@@ -5,17 +5,19 @@ from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS  # ChromaDB 대신 FAISS 사용
 from langchain_anthropic import ChatAnthropic
 from langchain_core.prompts import PromptTemplate
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
 import tempfile
+import threading
 import os
+import functools
 import hashlib
-import fitz  # PyMuPDF
+import multiprocessing
+import numpy as np
 import pandas as pd
-import pickle
-import base64
-from io import BytesIO
+from collections import Counter, OrderedDict
+from pydantic import PrivateAttr
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pdf_extractor import load_pdf_documents
 
 # 환경변수 설정 및 API 키 관리
 def load_config():
@@ -87,398 +89,274 @@ anthropic = "your-anthropic-key"
 # 전역 설정 로드
 APP_CONFIG = load_config()
 
-st.set_page_config(page_title="규정 챗봇")
-st.title("팜소프트 cGMP 규정 챗봇")
-st.caption("cGMP 규정에 대해서 자세히 알려드립니다.")
+# PDF 추출에 사용할 프로세스 수
+PDF_WORKERS = min(os.cpu_count() or 1, 4)
+
+# 멀티스레드로 동작하는 Streamlit 서버를 fork하지 않도록 PDF 추출 프로세스는 forkserver(없으면 spawn)로 시작
+PDF_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# 임베딩 요청을 동시에 보낼 스레드 수와 요청 1건에 담을 청크 수
+EMBED_WORKERS = 8
+EMBED_BATCH_SIZE = 128
+
+# HNSW 벡터 인덱스 설정 (이웃 수, 구축/검색 시 탐색 범위)
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# 문서 검색 설정 (MMR로 비슷한 내용이 반복되는 청크를 걸러낸다)
+MMR_SEARCH_KWARGS = {"k": 5, "fetch_k": 20, "lambda_mult": 0.5}  # 20개 후보 중 5개 문서 검색
+
+# 텍스트 분할기 (설정이 고정되어 있으므로 한 번만 생성)
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=1500,  # 표와 구조를 보존하기 위해 더 큰 청크
+    chunk_overlap=300,
+    length_function=len,
+    separators=["\n\n", "\n", ". ", " ", ""]
+)
+
+# 답변 생성용 프롬프트 템플릿
+QA_PROMPT = PromptTemplate(
+    template="""
+    당신은 cGMP 규정 전문가입니다. 다음 문서들을 바탕으로 질문에 정확하고 상세하게 답변해주세요.
+
+    문서 내용:
+    {context}
+
+    질문: {question}
 
-# API 키 확인 - 앱 시작 시 체크
-if not check_api_keys():
-    st.stop()  # API 키가 없으면 앱 실행 중단
+    답변 시 다음 사항을 준수해주세요:
+    1. 제공된 문서 내용만을 바탕으로 답변하세요
+    2. 구체적이고 실용적인 정보를 포함하세요
+    3. 단계별 절차가 있다면 순서대로 설명하세요
+    4. 문서에 없는 내용은 추측하지 마세요
 
-# 처음 1번만 실행하기 위한 코드
-if "messages" not in st.session_state:
-    # 대화기록을 저장하기 위한 용도로 생성한다.
-    st.session_state["messages"] = []
+    답변:
+    """,
+    input_variables=["context", "question"]
+)
+
+class CachedOpenAIEmbeddings(OpenAIEmbeddings):
+    """같은 텍스트를 다시 임베딩하지 않도록 결과를 LRU 방식으로 캐시하는 OpenAIEmbeddings (벡터는 float32 배열로 반환)"""
+
+    # st.cache_resource로 만든 인스턴스 하나를 모든 세션이 함께 쓰므로 캐시도 일부러 프로세스 전체에서 공유한다
+    # (같은 텍스트의 임베딩은 세션과 상관없이 같으므로 다른 세션이 올린 같은 문서도 다시 요청하지 않는다)
+    # 문서 임베딩이 질문 캐시를 밀어내지 않도록 질문은 별도의 LRU에 보관한다
+    cache_size: int = 2048
+    query_cache_size: int = 256
+    _cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _query_cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _cache_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @staticmethod
+    def _to_row(vector):
+        # float32로 보관해서 캐시 메모리를 줄이고, 공유하는 캐시가 바뀌지 않도록 읽기 전용으로 만든다
+        row = np.asarray(vector, dtype=np.float32)
+        row.flags.writeable = False
+        return row
+
+    def embed_documents(self, texts, chunk_size=None, **kwargs):
+        keys = [hashlib.blake2b(text.encode(), digest_size=16).hexdigest() for text in texts]
+
+        # 캐시에 있는 벡터는 재사용하고, 없는 텍스트만 API로 요청
+        # (여러 스레드에서 동시에 호출될 수 있으므로 캐시 접근은 잠금 안에서만 수행)
+        found = {}
+        missing = {}
+        with self._cache_lock:
+            for key, text in zip(keys, texts):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    found[key] = self._cache[key]
+                else:
+                    missing.setdefault(key, text)
+
+        if missing:
+            vectors = super().embed_documents(list(missing.values()), chunk_size=chunk_size, **kwargs)
+            with self._cache_lock:
+                for key, vector in zip(missing, vectors):
+                    found[key] = self._cache[key] = self._to_row(vector)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text, **kwargs):
+        # 질문은 짧으므로 해시 대신 원문을 그대로 키로 사용
+        with self._cache_lock:
+            if text in self._query_cache:
+                self._query_cache.move_to_end(text)
+                return self._query_cache[text]
+
+        # 문서 캐시를 거치지 않고 바로 API로 요청
+        vector = super().embed_documents([text], **kwargs)[0]
+        with self._cache_lock:
+            cached = self._query_cache[text] = self._to_row(vector)
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return cached
 
 # FAISS 관련 함수들
 @st.cache_resource
 def initialize_embeddings():
     """임베딩 모델 초기화 (캐시됨)"""
     try:
-        return OpenAIEmbeddings(
+        return CachedOpenAIEmbeddings(
             model="text-embedding-3-large",
-            openai_api_key=APP_CONFIG['openai_key']
+            openai_api_key=APP_CONFIG['openai_key'],
+            chunk_size=1000,  # 요청 1번에 최대 1000개 텍스트를 묶어서 임베딩
+            max_retries=6
         )
     except Exception as e:
         st.error(f"임베딩 모델 초기화 실패: {str(e)}")
         return None
 
-def save_vectorstore_to_session(vectorstore):
-    """FAISS 벡터 저장소를 세션 상태에 저장"""
-    try:
-        # FAISS 인덱스를 바이트로 직렬화
-        buffer = BytesIO()
-        
-        # 문서와 인덱스를 따로 저장
-        faiss_data = {
-            'docstore': dict(vectorstore.docstore._dict),
-            'index_to_docstore_id': vectorstore.index_to_docstore_id,
-        }
-        
-        # 인덱스를 바이트로 변환
-        import faiss
-        faiss.write_index(vectorstore.index, "temp_index.faiss")
-        with open("temp_index.faiss", "rb") as f:
-            index_bytes = f.read()
-        os.remove("temp_index.faiss")
-        
-        faiss_data['index_bytes'] = base64.b64encode(index_bytes).decode()
-        
-        # 세션 상태에 저장
-        st.session_state["vectorstore_data"] = base64.b64encode(
-            pickle.dumps(faiss_data)
-        ).decode()
-        
-        return True
-    except Exception as e:
-        st.warning(f"벡터 저장소 저장 중 오류: {e}")
-        return False
-
-def load_vectorstore_from_session(embedding):
-    """세션 상태에서 FAISS 벡터 저장소 복원"""
+# faiss는 프로세스 전역 OpenMP 설정을 쓰므로 처음 불러올 때 한 번만 스레드 수를 맞춘다
+@functools.lru_cache(maxsize=None)
+def import_faiss():
+    """faiss를 불러오고 OpenMP 스레드 수를 물리 코어 수로 제한합니다. (하이퍼스레드 경합 방지)"""
+    import faiss
+    import psutil
+    
+    # 물리 코어 수는 호스트 기준이므로 컨테이너/affinity로 허용된 CPU 수를 넘지 않게 제한
     try:
-        if "vectorstore_data" not in st.session_state:
-            return None
-            
-        # 데이터 복원
-        data = pickle.loads(
-            base64.b64decode(st.session_state["vectorstore_data"])
-        )
-        
-        # 인덱스 파일 복원
-        index_bytes = base64.b64decode(data['index_bytes'])
-        with open("temp_restore.faiss", "wb") as f:
-            f.write(index_bytes)
-        
-        # FAISS 인덱스 로드
-        import faiss
-        index = faiss.read_index("temp_restore.faiss")
-        os.remove("temp_restore.faiss")
-        
-        # FAISS 벡터 저장소 재구성
-        from langchain_community.docstore.in_memory import InMemoryDocstore
-        from langchain_core.documents import Document
-        
-        # 문서 저장소 복원
-        docstore = InMemoryDocstore()
-        for doc_id, doc_data in data['docstore'].items():
-            docstore._dict[doc_id] = Document(
-                page_content=doc_data['page_content'],
-                metadata=doc_data['metadata']
-            )
-        
-        # FAISS 객체 재구성
-        vectorstore = FAISS(
-            embedding_function=embedding,
-            index=index,
-            docstore=docstore,
-            index_to_docstore_id=data['index_to_docstore_id']
-        )
-        
-        return vectorstore
-        
-    except Exception as e:
-        st.warning(f"벡터 저장소 복원 중 오류: {e}")
-        return None
+        available_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # sched_getaffinity가 없는 macOS/Windows
+        available_cpus = os.cpu_count() or 1
+    faiss.omp_set_num_threads(min(psutil.cpu_count(logical=False) or 1, available_cpus))
+    return faiss
 
 def initialize_database():
     """FAISS 벡터 저장소 초기화"""
-    embedding = initialize_embeddings()
-    if not embedding:
-        return None
-    
-    # 세션에서 기존 벡터 저장소 복원 시도
-    vectorstore = load_vectorstore_from_session(embedding)
-    if vectorstore:
-        st.info("✅ 기존 벡터 저장소를 복원했습니다.")
-        return vectorstore
-    
-    # 새로운 벡터 저장소는 None으로 시작 (문서 추가 시 생성)
+    # 임베딩 모델만 미리 초기화하고, 벡터 저장소는 세션 상태에만 두며 첫 문서를 추가할 때 생성
+    initialize_embeddings()
     return None
 
-# 데이터베이스 초기화
-if "database" not in st.session_state:
-    st.session_state["database"] = initialize_database()
-
-# 사이드바 생성
-with st.sidebar:
-    st.header("📚 문서 관리")
-    
-    # API 키 상태 표시
-    with st.expander("🔑 API 설정 상태"):
-        if APP_CONFIG['openai_key']:
-            st.success("✅ OpenAI API Key 설정됨")
-        else:
-            st.error("❌ OpenAI API Key 없음")
-            
-        if APP_CONFIG['anthropic_key']:
-            st.success("✅ Anthropic API Key 설정됨")
-        else:
-            st.error("❌ Anthropic API Key 없음")
-            
-        if APP_CONFIG['langsmith_key']:
-            st.info(f"📊 LangSmith 프로젝트: {APP_CONFIG['langsmith_project']}")
-            
-        st.info("🚀 벡터 저장소: FAISS (메모리 기반)")
-    
-    # 저장된 문서 목록 표시
-    if "processed_files" not in st.session_state:
-        st.session_state["processed_files"] = set()
-    
-    if st.session_state["processed_files"]:
-        st.subheader("💾 저장된 문서")
-        for filename in st.session_state["processed_files"]:
-            st.write(f"✅ {filename}")
-        
-        # 데이터베이스 상태 확인 버튼
-        if st.button("🔍 DB 상태 확인"):
-            try:
-                if st.session_state["database"]:
-                    # FAISS에서 문서 수 확인
-                    total_docs = st.session_state["database"].index.ntotal
-                    st.info(f"총 저장된 벡터: {total_docs}개")
-                    
-                    # 문서별 정보 표시
-                    st.write("📊 저장된 파일:")
-                    for filename in st.session_state["processed_files"]:
-                        st.write(f"  • {filename}")
-                        
-                else:
-                    st.warning("벡터 저장소가 초기화되지 않았습니다.")
-                    
-            except Exception as e:
-                st.error(f"DB 상태 확인 실패: {str(e)}")
-    else:
-        st.info("아직 업로드된 문서가 없습니다.")
-    
-    st.divider()
-    
-    # 초기화 버튼 생성
-    clear_btn = st.button("💬 대화 초기화")
-    
-    # 데이터베이스 초기화 버튼
-    if st.button("🗑️ 전체 데이터베이스 초기화", type="secondary"):
-        try:
-            # 세션 상태에서 벡터 저장소 제거
-            if "database" in st.session_state:
-                del st.session_state["database"]
-            
-            # 저장된 벡터 데이터 제거
-            if "vectorstore_data" in st.session_state:
-                del st.session_state["vectorstore_data"]
-            
-            # 캐시 클리어
-            initialize_embeddings.clear()
-            
-            # 처리된 파일 목록 초기화
-            st.session_state["processed_files"] = set()
-            st.session_state["messages"] = []
-            st.session_state["database"] = None
-            
-            st.success("데이터베이스가 완전히 초기화되었습니다.")
-            st.info("새 문서를 업로드해주세요.")
-            
-        except Exception as e:
-            st.error(f"데이터베이스 초기화 중 오류 발생: {str(e)}")
+def new_file_hasher():
+    """중복 확인용 파일 해시 객체를 생성합니다. (암호학적 용도가 아니므로 빠른 BLAKE2b 사용)"""
+    return hashlib.blake2b(digest_size=16)
 
 def get_file_hash(file_content):
     """파일 내용의 해시값을 생성합니다."""
-    return hashlib.md5(file_content).hexdigest()
+    hasher = new_file_hasher()
+    hasher.update(file_content)
+    return hasher.hexdigest()
 
 def is_file_already_processed(filename, file_hash):
     """파일이 이미 처리되었는지 확인합니다."""
-    # FAISS는 메타데이터 검색이 제한적이므로 간단히 파일명으로만 확인
+    # 세션에 보관한 해시 집합으로 먼저 확인하고, 없으면 파일명으로 확인
+    if file_hash in st.session_state.get("file_hashes", set()):
+        return True
     return filename in st.session_state.get("processed_files", set())
 
-def extract_pdf_content_advanced(file_path):
-    """PyMuPDF를 사용해서 PDF에서 텍스트, 표, 구조 정보를 추출합니다."""
-    doc = fitz.open(file_path)
-    documents = []
-    
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        
-        # 기본 텍스트 추출
-        text = page.get_text()
-        
-        # 표 추출 시도
-        tables = page.find_tables()
-        table_content = ""
-        
-        if tables:
-            for table_num, table in enumerate(tables):
-                try:
-                    # 표 데이터를 추출하고 문자열로 변환
-                    table_data = table.extract()
-                    if table_data:
-                        # 표를 마크다운 형식으로 변환
-                        table_text = f"\n\n[표 {table_num + 1}]\n"
-                        for row in table_data:
-                            # None 값을 빈 문자열로 변환
-                            clean_row = [str(cell) if cell is not None else "" for cell in row]
-                            table_text += "| " + " | ".join(clean_row) + " |\n"
-                        table_content += table_text
-                except Exception as e:
-                    st.warning(f"표 추출 중 오류 (페이지 {page_num + 1}): {str(e)}")
-        
-        # 이미지 정보 추출
-        image_list = page.get_images()
-        image_content = ""
-        if image_list:
-            image_content = f"\n\n[이 페이지에는 {len(image_list)}개의 이미지가 포함되어 있습니다]\n"
-        
-        # 텍스트 블록 정보 (서식, 위치 등)
-        blocks = page.get_text("dict")
-        structured_text = ""
-        
-        for block in blocks["blocks"]:
-            if "lines" in block:
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        # 폰트 크기와 스타일 정보 포함
-                        font_size = span.get("size", 12)
-                        font_flags = span.get("flags", 0)
-                        text_content = span.get("text", "")
-                        
-                        # 제목이나 중요한 텍스트 식별 (큰 폰트나 볼드)
-                        if font_size > 14 or font_flags & 2**4:  # 볼드 체크
-                            structured_text += f"\n### {text_content}\n"
-                        else:
-                            structured_text += text_content
-        
-        # 모든 내용 결합
-        combined_content = f"""
-페이지 {page_num + 1} 내용:
-
-{text}
+# 업로드된 파일(UploadedFile)은 이미 메모리에 있는 BytesIO이므로 getbuffer()로 복사 없이 읽는다
+def get_uploaded_file_hash(uploaded_file):
+    """업로드된 파일의 해시값을 생성합니다."""
+    with uploaded_file.getbuffer() as buffer:
+        return get_file_hash(buffer)
+
+def save_uploaded_pdf(uploaded_file):
+    """업로드된 파일을 임시 PDF 파일로 저장하고 경로를 반환합니다."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        with uploaded_file.getbuffer() as buffer:
+            tmp_file.write(buffer)
+    return tmp_file.name
+
+def create_vectorstore(embedding, dimension):
+    """HNSW 인덱스를 사용하는 빈 FAISS 벡터 저장소를 생성합니다."""
+    faiss = import_faiss()
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores.utils import DistanceStrategy
+    
+    # 전체 벡터를 훑는 IndexFlatL2 대신 그래프 기반 근사 검색 사용
+    # 벡터는 정규화해서 넣으므로 내적(코사인 유사도) 기준으로 검색
+    index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    
+    return FAISS(
+        embedding_function=embedding,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+    )
 
-{table_content}
+def normalize_vectors(vectors):
+    """벡터들을 단위 길이로 정규화한 float32 배열을 반환합니다."""
+    faiss = import_faiss()
+    
+    matrix = np.array(vectors, dtype="float32", ndmin=2)
+    faiss.normalize_L2(matrix)
+    return matrix
 
-{image_content}
+def embed_splits(embedding, splits):
+    """분할된 문서들의 임베딩 벡터를 계산합니다. (벡터 저장소와 세션 상태를 건드리지 않으므로 스레드에서 실행 가능)"""
+    return embedding.embed_documents([split.page_content for split in splits])
 
-구조화된 텍스트:
-{structured_text}
-        """.strip()
-        
-        # Document 객체 생성
-        doc_obj = Document(
-            page_content=combined_content,
-            metadata={
-                "page": page_num + 1,
-                "has_tables": len(tables) > 0,
-                "table_count": len(tables),
-                "image_count": len(image_list),
-                "total_pages": len(doc)
-            }
-        )
-        documents.append(doc_obj)
+def add_splits_to_database(embedding, splits, vectors):
+    """임베딩된 문서들을 세션 상태의 FAISS 벡터 저장소에 한 번에 추가합니다."""
+    vectors = normalize_vectors(vectors)
+    
+    if st.session_state["database"] is None:
+        # 새로운 FAISS 벡터 저장소 생성
+        st.session_state["database"] = create_vectorstore(embedding, vectors.shape[1])
     
-    doc.close()
-    return documents
+    # HNSW 인덱스는 추가 학습 없이 벡터를 바로 추가할 수 있음
+    # (한 번에 추가해야 실패했을 때 일부 파일의 청크만 남지 않음)
+    st.session_state["database"].add_embeddings(
+        zip((split.page_content for split in splits), vectors),
+        metadatas=[split.metadata for split in splits]
+    )
 
-def process_pdf_file(uploaded_file):
-    """PDF 파일을 처리하고 FAISS 벡터 저장소에 저장합니다."""
+def process_pdf_file(uploaded_file, file_hash, documents, extraction_method, total_tables=0, total_images=0):
+    """추출된 PDF 문서를 분할합니다. (결과 메시지, 분할된 문서 또는 None)을 반환합니다."""
     try:
-        # 임베딩 모델 가져오기
-        embedding = initialize_embeddings()
-        if not embedding:
-            return f"❌ '{uploaded_file.name}': 임베딩 모델 초기화 실패"
+        if not documents:
+            return f"❌ '{uploaded_file.name}': PDF에서 텍스트를 추출할 수 없습니다.", None
         
-        # 파일 내용 읽기
-        file_content = uploaded_file.read()
-        file_hash = get_file_hash(file_content)
+        # 텍스트 분할 (더 큰 청크 크기로 표와 구조 보존)
+        splits = TEXT_SPLITTER.split_documents(documents)
         
-        # 중복 체크
-        if is_file_already_processed(uploaded_file.name, file_hash):
-            return f"⚠️ '{uploaded_file.name}'은 이미 처리된 파일입니다."
+        # 메타데이터에 파일 정보 추가 (파일 단위로 같은 값은 한 번만 계산)
+        file_metadata = {
+            'source': uploaded_file.name,
+            'file_hash': file_hash,
+            'upload_time': str(st.session_state.get('current_time', '')),
+            'extraction_method': extraction_method
+        }
+        for i, split in enumerate(splits, start=1):
+            metadata = split.metadata
+            split.metadata = {
+                **file_metadata,
+                'page': metadata.get('page', 1),
+                'chunk_id': f"{uploaded_file.name}_chunk_{i}",
+                'has_tables': metadata.get('has_tables', False),
+                'table_count': metadata.get('table_count', 0),
+                'image_count': metadata.get('image_count', 0)
+            }
         
-        # 임시 파일로 저장
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(file_content)
-            tmp_file_path = tmp_file.name
+        # 상세 정보 포함한 성공 메시지
+        table_info = ""
+        image_info = ""
+        if total_tables > 0:
+            table_info = f", 표 {total_tables}개"
+        if total_images > 0:
+            image_info = f", 이미지 {total_images}개"
+        
+        return f"✅ '{uploaded_file.name}': {len(splits)}개 청크로 처리 완료 ({extraction_method}{table_info}{image_info})", splits
         
-        try:
-            # 고급 PDF 추출 시도
-            try:
-                documents = extract_pdf_content_advanced(tmp_file_path)
-                extraction_method = "고급 추출 (표, 이미지, 구조 포함)"
-            except Exception as e:
-                # 기본 PDF 로더로 폴백
-                loader = PyPDFLoader(tmp_file_path)
-                documents = loader.load()
-                extraction_method = "기본 추출"
-            
-            if not documents:
-                return f"❌ '{uploaded_file.name}': PDF에서 텍스트를 추출할 수 없습니다."
-            
-            # 텍스트 분할 (더 큰 청크 크기로 표와 구조 보존)
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1500,  # 표와 구조를 보존하기 위해 더 큰 청크
-                chunk_overlap=300,
-                length_function=len,
-                separators=["\n\n", "\n", ". ", " ", ""]
-            )
-            splits = text_splitter.split_documents(documents)
-            
-            # 메타데이터에 파일 정보 추가
-            for i, split in enumerate(splits):
-                original_metadata = split.metadata.copy()
-                split.metadata = {
-                    'source': uploaded_file.name,
-                    'file_hash': file_hash,
-                    'upload_time': str(st.session_state.get('current_time', '')),
-                    'page': original_metadata.get('page', 1),
-                    'chunk_id': f"{uploaded_file.name}_chunk_{i+1}",
-                    'has_tables': original_metadata.get('has_tables', False),
-                    'table_count': original_metadata.get('table_count', 0),
-                    'image_count': original_metadata.get('image_count', 0),
-                    'extraction_method': extraction_method
-                }
-            
-            # FAISS 벡터 저장소 생성/업데이트
-            if st.session_state["database"] is None:
-                # 새로운 FAISS 벡터 저장소 생성
-                st.session_state["database"] = FAISS.from_documents(splits, embedding)
-            else:
-                # 기존 벡터 저장소에 문서 추가
-                new_vectorstore = FAISS.from_documents(splits, embedding)
-                st.session_state["database"].merge_from(new_vectorstore)
-            
-            # 세션 상태에 저장
-            save_vectorstore_to_session(st.session_state["database"])
-            
-            # 처리된 파일 목록에 추가
-            st.session_state["processed_files"].add(uploaded_file.name)
-            
-            # 상세 정보 포함한 성공 메시지
-            table_info = ""
-            image_info = ""
-            total_tables = sum(doc.metadata.get('table_count', 0) for doc in documents)
-            total_images = sum(doc.metadata.get('image_count', 0) for doc in documents)
-            
-            if total_tables > 0:
-                table_info = f", 표 {total_tables}개"
-            if total_images > 0:
-                image_info = f", 이미지 {total_images}개"
-            
-            return f"✅ '{uploaded_file.name}': {len(splits)}개 청크로 처리 완료 ({extraction_method}{table_info}{image_info})"
-            
-        finally:
-            # 임시 파일 삭제
-            os.unlink(tmp_file_path)
-            
     except Exception as e:
-        return f"❌ '{uploaded_file.name}': 처리 중 오류 발생 - {str(e)}"
+        return f"❌ '{uploaded_file.name}': 처리 중 오류 발생 - {str(e)}", None
+
+def show_process_result(result):
+    """파일 처리 결과 메시지를 종류에 맞게 표시합니다."""
+    if result.startswith("✅"):
+        st.success(result)
+    elif result.startswith("⚠️"):
+        st.warning(result)
+    else:
+        st.error(result)
 
 # 이전 대화를 출력
 def print_messages():
@@ -489,6 +367,30 @@ def print_messages():
 def add_message(role, message):
     st.session_state["messages"].append(ChatMessage(role=role, content=message))
 
+@st.cache_resource
+def get_llm():
+    """Claude 모델 초기화 (API 키 명시적 전달, 캐시됨)"""
+    return ChatAnthropic(
+        model="claude-sonnet-4-20250514",
+        anthropic_api_key=APP_CONFIG['anthropic_key']
+    )
+
+def stream_answer(llm, formatted_prompt):
+    """Claude 답변을 생성되는 대로 텍스트 조각 단위로 반환합니다."""
+    for chunk in llm.stream(formatted_prompt):
+        if chunk.content:
+            yield chunk.content
+
+def search_documents(database, user_input):
+    """질문을 임베딩해서 FAISS 인덱스에서 바로 MMR 검색합니다. (retriever 래퍼를 거치지 않음)"""
+    # HNSW 인덱스의 검색 범위 설정 (이전 방식의 Flat 인덱스에는 해당 없음)
+    if hasattr(database.index, "hnsw"):
+        database.index.hnsw.efSearch = HNSW_EF_SEARCH
+    
+    # 저장된 벡터와 같은 방식으로 질문 벡터도 정규화
+    query_vector = normalize_vectors(database.embedding_function.embed_query(user_input))[0]
+    return database.max_marginal_relevance_search_by_vector(query_vector, **MMR_SEARCH_KWARGS)
+
 def get_ai_message(user_input):
     # 데이터베이스 확인
     if "database" not in st.session_state or st.session_state["database"] is None:
@@ -497,19 +399,9 @@ def get_ai_message(user_input):
             "sources": []
         }
     
-    # Claude 모델 초기화 (API 키 명시적 전달)
-    llm = ChatAnthropic(
-        model="claude-sonnet-4-20250514",
-        anthropic_api_key=APP_CONFIG['anthropic_key']
-    )
-    
     try:
-        # FAISS에서 유사도 검색 (retriever 방식)
-        retriever = st.session_state["database"].as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 5}  # 5개 문서 검색
-        )
-        docs = retriever.get_relevant_documents(user_input)
+        # FAISS에서 MMR 검색
+        docs = search_documents(st.session_state["database"], user_input)
     except Exception as e:
         return {
             "answer": f"문서 검색 중 오류가 발생했습니다: {str(e)}\n\n문서를 다시 업로드해주세요.",
@@ -522,119 +414,282 @@ def get_ai_message(user_input):
             "sources": []
         }
     
-    # 컨텍스트 생성
-    context = "\n\n".join([f"[문서: {doc.metadata.get('source', '알 수 없음')}]\n{doc.page_content}" for doc in docs])
-    
-    # 출처 정보 수집 (중복 제거 및 정리)
-    sources = []
+    # 컨텍스트와 출처 정보를 한 번의 순회로 생성 (출처는 삽입 순서를 유지하는 dict로 중복 제거)
+    context_parts = []
+    sources_set = {}
     for doc in docs:
-        if hasattr(doc, 'metadata') and doc.metadata:
-            source_name = doc.metadata.get('source', '알 수 없는 출처')
-            page_num = doc.metadata.get('page', '')
-            
-            # 출처 정보 포맷팅
-            if page_num and str(page_num).isdigit():
-                source_info = f"{source_name} (페이지 {page_num})"
-            else:
-                source_info = source_name
-            
-            if source_info not in sources:  # 중복 제거
-                sources.append(source_info)
-    
-    # 프롬프트 템플릿 생성
-    prompt_template = """
-    당신은 cGMP 규정 전문가입니다. 다음 문서들을 바탕으로 질문에 정확하고 상세하게 답변해주세요.
-
-    문서 내용:
-    {context}
-
-    질문: {question}
-
-    답변 시 다음 사항을 준수해주세요:
-    1. 제공된 문서 내용만을 바탕으로 답변하세요
-    2. 구체적이고 실용적인 정보를 포함하세요
-    3. 단계별 절차가 있다면 순서대로 설명하세요
-    4. 문서에 없는 내용은 추측하지 마세요
-
-    답변:
-    """
-    
-    prompt = PromptTemplate(
-        template=prompt_template,
-        input_variables=["context", "question"]
-    )
+        metadata = doc.metadata or {}
+        context_parts.append(f"[문서: {metadata.get('source', '알 수 없음')}]\n{doc.page_content}")
+        if not metadata:
+            continue
+        
+        source_name = metadata.get('source', '알 수 없는 출처')
+        page_num = metadata.get('page', '')
+        
+        # 출처 정보 포맷팅
+        if page_num and str(page_num).isdigit():
+            source_info = f"{source_name} (페이지 {page_num})"
+        else:
+            source_info = source_name
+        
+        sources_set.setdefault(source_info, None)
+    context = "\n\n".join(context_parts)
+    sources = list(sources_set)
     
-    # LLM에 질문
-    formatted_prompt = prompt.format(context=context, question=user_input)
-    response = llm.invoke(formatted_prompt)
+    # LLM에 질문 (답변은 토큰 단위로 스트리밍)
+    llm = get_llm()
+    formatted_prompt = QA_PROMPT.format(context=context, question=user_input)
     
-    # 응답과 출처 정보를 딕셔너리로 반환
+    # 스트리밍 답변과 출처 정보를 딕셔너리로 반환
     return {
-        "answer": response.content if hasattr(response, 'content') else str(response),
+        "answer": stream_answer(llm, formatted_prompt),
         "sources": sources
     }
 
-# 초기화 버튼이 눌리면...
-if clear_btn:
-    st.session_state["messages"] = []
-
-# 이전 대화 기록 출력
-print_messages()
-
-# 파일 업로드 섹션 (챗 입력 위에)
-st.subheader("📎 문서 업로드")
-col1, col2 = st.columns([3, 1])
-
-with col1:
-    uploaded_files = st.file_uploader(
-        "PDF 파일을 업로드해서 챗봇에 학습시키세요",
-        type=['pdf'],
-        accept_multiple_files=True,
-        help="여러 PDF 파일을 동시에 업로드할 수 있습니다.",
-        key="main_uploader"
-    )
-
-with col2:
-    if uploaded_files:
-        process_btn = st.button("📥 문서 처리하기", type="primary", key="main_process")
-
-# 파일 처리 로직
-if uploaded_files and 'process_btn' in locals() and process_btn:
-    import datetime
-    st.session_state['current_time'] = str(datetime.datetime.now())
+def main():
+    """챗봇 화면을 구성하고 사용자 입력을 처리합니다."""
+    st.set_page_config(page_title="규정 챗봇")
+    st.title("팜소프트 cGMP 규정 챗봇")
+    st.caption("cGMP 규정에 대해서 자세히 알려드립니다.")
     
-    with st.spinner("📄 PDF 파일들을 처리하고 있습니다..."):
-        results = []
-        for uploaded_file in uploaded_files:
-            result = process_pdf_file(uploaded_file)
-            results.append(result)
+    # API 키 확인 - 앱 시작 시 체크
+    if not check_api_keys():
+        st.stop()  # API 키가 없으면 앱 실행 중단
+    
+    # 처음 1번만 실행하기 위한 코드
+    if "messages" not in st.session_state:
+        # 대화기록을 저장하기 위한 용도로 생성한다.
+        st.session_state["messages"] = []
+    
+    # 데이터베이스 초기화
+    if "database" not in st.session_state:
+        st.session_state["database"] = initialize_database()
+    
+    # 중복 확인용 파일 해시 집합 (처리한 파일의 해시를 세션 동안 모아 둔다)
+    if "file_hashes" not in st.session_state:
+        st.session_state["file_hashes"] = set()
+    
+    # 사이드바 생성
+    with st.sidebar:
+        st.header("📚 문서 관리")
         
-        # 결과 표시
-        for result in results:
-            if result.startswith("✅"):
-                st.success(result)
-            elif result.startswith("⚠️"):
-                st.warning(result)
+        # API 키 상태 표시
+        with st.expander("🔑 API 설정 상태"):
+            if APP_CONFIG['openai_key']:
+                st.success("✅ OpenAI API Key 설정됨")
+            else:
+                st.error("❌ OpenAI API Key 없음")
+                
+            if APP_CONFIG['anthropic_key']:
+                st.success("✅ Anthropic API Key 설정됨")
             else:
-                st.error(result)
+                st.error("❌ Anthropic API Key 없음")
+                
+            if APP_CONFIG['langsmith_key']:
+                st.info(f"📊 LangSmith 프로젝트: {APP_CONFIG['langsmith_project']}")
+                
+            st.info("🚀 벡터 저장소: FAISS (메모리 기반)")
         
-        # 처리 완료 메시지
-        st.info("📄 문서 처리가 완료되었습니다!")
-
-st.divider()
-
-# 사용자의 입력
-user_input = st.chat_input("cGMP 규정 관련하여 궁금한 내용을 말씀해 주세요.")
-
-# 만약에 사용자 입력이 들어오면...
-if user_input:
+        # 저장된 문서 목록 표시
+        if "processed_files" not in st.session_state:
+            st.session_state["processed_files"] = set()
+        
+        if st.session_state["processed_files"]:
+            st.subheader("💾 저장된 문서")
+            for filename in st.session_state["processed_files"]:
+                st.write(f"✅ {filename}")
+            
+            # 데이터베이스 상태 확인 버튼
+            if st.button("🔍 DB 상태 확인"):
+                try:
+                    if st.session_state["database"]:
+                        # FAISS 인덱스의 벡터 수로 문서 수 확인 (문서/임베딩을 꺼내지 않음)
+                        total_docs = st.session_state["database"].index.ntotal
+                        st.info(f"총 저장된 벡터: {total_docs}개")
+                        
+                        # 문서별 정보 표시 (메타데이터만 사용)
+                        chunk_counts = Counter(
+                            doc.metadata.get("source", "알 수 없음")
+                            for doc in st.session_state["database"].docstore._dict.values()
+                        )
+                        st.write("📊 저장된 파일:")
+                        for filename, chunk_count in chunk_counts.items():
+                            st.write(f"  • {filename}: {chunk_count}개 청크")
+                            
+                    else:
+                        st.warning("벡터 저장소가 초기화되지 않았습니다.")
+                        
+                except Exception as e:
+                    st.error(f"DB 상태 확인 실패: {str(e)}")
+        else:
+            st.info("아직 업로드된 문서가 없습니다.")
+        
+        st.divider()
+        
+        # 초기화 버튼 생성
+        clear_btn = st.button("💬 대화 초기화")
+        
+        # 데이터베이스 초기화 버튼
+        if st.button("🗑️ 전체 데이터베이스 초기화", type="secondary"):
+            try:
+                # 세션 상태에서 벡터 저장소 제거
+                if "database" in st.session_state:
+                    del st.session_state["database"]
+                
+                # 캐시 클리어
+                initialize_embeddings.clear()
+                
+                # 처리된 파일 목록 초기화
+                st.session_state["processed_files"] = set()
+                st.session_state["file_hashes"] = set()
+                st.session_state["messages"] = []
+                st.session_state["database"] = None
+                
+                st.success("데이터베이스가 완전히 초기화되었습니다.")
+                st.info("새 문서를 업로드해주세요.")
+                
+            except Exception as e:
+                st.error(f"데이터베이스 초기화 중 오류 발생: {str(e)}")
+    
+    # 초기화 버튼이 눌리면...
+    if clear_btn:
+        st.session_state["messages"] = []
+    
+    # 이전 대화 기록 출력
+    print_messages()
+    
+    # 파일 업로드 섹션 (챗 입력 위에)
+    st.subheader("📎 문서 업로드")
+    col1, col2 = st.columns([3, 1])
+    
+    with col1:
+        uploaded_files = st.file_uploader(
+            "PDF 파일을 업로드해서 챗봇에 학습시키세요",
+            type=['pdf'],
+            accept_multiple_files=True,
+            help="여러 PDF 파일을 동시에 업로드할 수 있습니다.",
+            key="main_uploader"
+        )
+    
+    with col2:
+        if uploaded_files:
+            process_btn = st.button("📥 문서 처리하기", type="primary", key="main_process")
+    
+    # 파일 처리 로직
+    if uploaded_files and 'process_btn' in locals() and process_btn:
+        import datetime
+        st.session_state['current_time'] = str(datetime.datetime.now())
+        
+        with st.status("📄 PDF 파일들을 처리하고 있습니다...", expanded=True) as status:
+            # 내용 해시로 중복 체크 후, 처리할 파일만 임시 파일로 저장
+            # (이번에 함께 올린 파일끼리도 내용이 같으면 하나만 처리)
+            pending_files = []
+            pending_hashes = set()
+            for uploaded_file in uploaded_files:
+                status.update(label=f"📄 '{uploaded_file.name}' 확인 중...")
+                file_hash = get_uploaded_file_hash(uploaded_file)
+                if is_file_already_processed(uploaded_file.name, file_hash):
+                    show_process_result(f"⚠️ '{uploaded_file.name}'은 이미 처리된 파일입니다.")
+                    continue
+                if file_hash in pending_hashes:
+                    show_process_result(f"⚠️ '{uploaded_file.name}'은 함께 업로드한 다른 파일과 내용이 같습니다.")
+                    continue
+                pending_hashes.add(file_hash)
+                pending_files.append((uploaded_file, file_hash, save_uploaded_pdf(uploaded_file)))
+    
+            # 임베딩 모델 가져오기
+            embedding = initialize_embeddings()
+            if pending_files and not embedding:
+                for uploaded_file, _, tmp_file_path in pending_files:
+                    os.unlink(tmp_file_path)
+                    show_process_result(f"❌ '{uploaded_file.name}': 임베딩 모델 초기화 실패")
+                pending_files = []
+    
+            if pending_files:
+                try:
+                    # PDF 추출은 CPU 작업이므로 프로세스 풀에서, 임베딩은 네트워크 대기이므로 스레드 풀에서 병렬 처리
+                    pdf_workers = min(PDF_WORKERS, len(pending_files))
+                    with ProcessPoolExecutor(max_workers=pdf_workers, mp_context=PDF_MP_CONTEXT) as executor, \
+                            ThreadPoolExecutor(max_workers=EMBED_WORKERS) as embed_executor:
+                        futures = {
+                            executor.submit(load_pdf_documents, tmp_file_path): (uploaded_file, file_hash)
+                            for uploaded_file, file_hash, tmp_file_path in pending_files
+                        }
+                        status.update(label=f"📄 PDF {len(futures)}개에서 내용을 추출하고 있습니다...")
+    
+                        # 추출이 끝나는 파일부터 분할해서 임베딩을 요청 (다른 파일의 추출과 겹쳐서 진행)
+                        embed_jobs = []
+                        for done_count, future in enumerate(as_completed(futures), start=1):
+                            uploaded_file, file_hash = futures[future]
+                            status.update(label=f"📄 '{uploaded_file.name}' 추출 완료 ({done_count}/{len(futures)})")
+                            try:
+                                documents, extraction_method, total_tables, total_images = future.result()
+                            except Exception as e:
+                                show_process_result(f"❌ '{uploaded_file.name}': 처리 중 오류 발생 - {str(e)}")
+                                continue
+                            result, splits = process_pdf_file(
+                                uploaded_file, file_hash, documents, extraction_method, total_tables, total_images
+                            )
+                            if splits is None:
+                                show_process_result(result)
+                                continue
+                            st.write(f"📄 '{uploaded_file.name}': 추출 완료, 청크 {len(splits)}개")
+                            # 큰 파일도 여러 요청이 동시에 진행되도록 청크를 나누어 임베딩 요청
+                            batch_futures = [
+                                embed_executor.submit(embed_splits, embedding, splits[start:start + EMBED_BATCH_SIZE])
+                                for start in range(0, len(splits), EMBED_BATCH_SIZE)
+                            ]
+                            embed_jobs.append((uploaded_file.name, file_hash, result, splits, batch_futures))
+    
+                        # 임베딩된 문서는 모아서 메인 스레드에서 한 번에 벡터 저장소에 추가
+                        status.update(label="🧠 문서를 임베딩하고 있습니다...")
+                        all_splits = []
+                        all_vectors = []
+                        split_results = []
+                        for filename, file_hash, result, splits, batch_futures in embed_jobs:
+                            try:
+                                vectors = [vector for batch_future in batch_futures for vector in batch_future.result()]
+                            except Exception as e:
+                                show_process_result(f"❌ '{filename}': 처리 중 오류 발생 - {str(e)}")
+                                continue
+                            all_splits.extend(splits)
+                            all_vectors.extend(vectors)
+                            split_results.append((filename, file_hash, result))
+    
+                    if all_splits:
+                        status.update(label=f"🧠 청크 {len(all_splits)}개를 벡터 저장소에 추가하고 있습니다...")
+                        try:
+                            add_splits_to_database(embedding, all_splits, all_vectors)
+                            # 처리된 파일 목록에 추가
+                            for filename, file_hash, result in split_results:
+                                st.session_state["processed_files"].add(filename)
+                                st.session_state["file_hashes"].add(file_hash)
+                                show_process_result(result)
+                        except Exception as e:
+                            for filename, _, _ in split_results:
+                                show_process_result(f"❌ '{filename}': 처리 중 오류 발생 - {str(e)}")
+                finally:
+                    # 임시 파일 삭제
+                    for _, _, tmp_file_path in pending_files:
+                        os.unlink(tmp_file_path)
+    
+            # 처리 완료 메시지
+            status.update(label="📄 문서 처리가 완료되었습니다!", state="complete")
+    
+    st.divider()
+    
     # 사용자의 입력
-    st.chat_message("user").write(user_input)
-
-    # AI 응답
-    with st.spinner("답변을 생성하고 있습니다..."):
+    user_input = st.chat_input("cGMP 규정 관련하여 궁금한 내용을 말씀해 주세요.")
+    
+    # 만약에 사용자 입력이 들어오면...
+    if user_input:
+        # 사용자의 입력
+        st.chat_message("user").write(user_input)
+    
+        # AI 응답 (답변은 생성되는 대로 스트리밍으로 표시)
         try:
-            ai_response = get_ai_message(user_input)
+            with st.spinner("관련 문서를 검색하고 있습니다..."):
+                ai_response = get_ai_message(user_input)
             
             # 답변과 출처 분리
             if isinstance(ai_response, dict):
@@ -642,7 +697,10 @@ if user_input:
                 sources = ai_response.get("sources", [])
                 
                 # AI 답변 표시
-                st.chat_message("ai").write(answer)
+                if isinstance(answer, str):
+                    st.chat_message("ai").write(answer)
+                else:
+                    answer = st.chat_message("ai").write_stream(answer)
                 
                 # 출처 정보 표시
                 if sources:
@@ -666,4 +724,8 @@ if user_input:
             
         except Exception as e:
             st.error(f"오류가 발생했습니다: {str(e)}")
-            st.info("API 키 설정과 벡터 저장소 상태를 확인해주세요.")
\ No newline at end of file
+            st.info("API 키 설정과 벡터 저장소 상태를 확인해주세요.")
+
+# PDF 추출 프로세스(forkserver/spawn)는 이 파일을 __mp_main__으로 다시 불러오므로, 그때는 화면을 구성하지 않는다
+if __name__ != "__mp_main__":
+    main()
@@ -0,0 +1,143 @@
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+import fitz  # PyMuPDF
+
+# 프로세스 풀 워커에서 실행되므로 이 모듈에서는 streamlit을 사용하지 않는다.
+
+# True(기본값)이면 get_text("dict")로 span마다 폰트 크기와 볼드 여부를 확인해서 제목을 찾는다.
+# False이면 더 빠른 get_text("blocks")의 줄 높이로 큰 글씨 제목만 찾는다.
+# (볼드 제목은 찾지 못하고, 줄 높이가 큰 폰트의 14pt 미만 본문도 제목으로 볼 수 있다)
+STRUCTURED_TEXT_HIGH_FIDELITY = True
+
+# 한 줄짜리 블록의 높이가 이 값보다 크면 제목으로 본다 (14pt 폰트의 줄 높이 기준)
+_HEADING_LINE_HEIGHT = 17
+
+# PyMuPDF span flags의 볼드 비트
+_BOLD = 1 << 4
+
+# dict 추출 옵션 (이미지 블록은 건너뛰므로 이미지 데이터를 파이썬 객체로 복사하지 않는다)
+_DICT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+def _extract_text_blocks(page):
+    """블록 단위 텍스트로 (기본 텍스트, 구조화된 텍스트)를 만듭니다. 제목은 한 줄짜리 블록의 높이로 판단합니다."""
+    text_parts = []
+    structured_parts = []
+
+    for x0, y0, x1, y1, block_text, _, block_type in page.get_text("blocks", sort=True):
+        if block_type != 0:  # 이미지 블록
+            continue
+        text_parts.append(block_text)
+
+        # 높이가 큰 한 줄짜리 블록은 큰 폰트의 제목으로 간주
+        # (여러 줄 블록의 높이에는 줄 간격이 포함되어 줄 간격이 넓은 본문도 제목처럼 보이므로 제외)
+        heading_text = block_text.strip()
+        if "\n" not in heading_text and y1 - y0 > _HEADING_LINE_HEIGHT:
+            structured_parts.append(f"\n### {heading_text}\n")
+        else:
+            structured_parts.append(block_text)
+
+    return "\n".join(text_parts), "".join(structured_parts)
+
+def _extract_text_dict(page):
+    """span 단위 정보로 (기본 텍스트, 구조화된 텍스트)를 만듭니다. 폰트 크기와 볼드를 정확히 판단합니다."""
+    # 텍스트 블록 정보 (서식, 위치 등) - 기본 텍스트도 같은 결과에서 만든다
+    blocks = page.get_text("dict", flags=_DICT_FLAGS)
+    text_parts = []
+    structured_parts = []
+
+    for block in blocks["blocks"]:
+        if "lines" in block:
+            for line in block["lines"]:
+                for span in line["spans"]:
+                    text_content = span["text"]
+                    text_parts.append(text_content)
+
+                    # 제목이나 중요한 텍스트 식별 (큰 폰트나 볼드)
+                    if span["size"] > 14 or span["flags"] & _BOLD:  # 볼드 체크
+                        structured_parts.append(f"\n### {text_content}\n")
+                    else:
+                        structured_parts.append(text_content)
+                text_parts.append("\n")
+            text_parts.append("\n")
+    return "".join(text_parts), "".join(structured_parts)
+
+def extract_pdf_content_advanced(file_path):
+    """PyMuPDF를 사용해서 PDF에서 텍스트, 표, 구조 정보를 추출합니다."""
+    doc = fitz.open(file_path)
+    documents = []
+    total_pages = doc.page_count
+    total_tables = total_images = 0
+
+    for page_num, page in enumerate(doc, start=1):
+        # 기본 텍스트와 구조화된 텍스트 추출
+        if STRUCTURED_TEXT_HIGH_FIDELITY:
+            text, structured_text = _extract_text_dict(page)
+        else:
+            text, structured_text = _extract_text_blocks(page)
+
+        # 표 추출 시도
+        tables = page.find_tables().tables
+        table_count = len(tables)
+        table_parts = []
+
+        if tables:
+            for table_num, table in enumerate(tables):
+                try:
+                    # 표 데이터를 추출하고 문자열로 변환
+                    table_data = table.extract()
+                    if table_data:
+                        # 표를 마크다운 형식으로 변환
+                        table_text_parts = [f"\n\n[표 {table_num + 1}]\n"]
+                        for row in table_data:
+                            # None 값을 빈 문자열로 변환
+                            clean_row = [str(cell) if cell is not None else "" for cell in row]
+                            table_text_parts.append("| " + " | ".join(clean_row) + " |\n")
+                        table_parts.append("".join(table_text_parts))
+                except Exception:
+                    # 깨진 표는 건너뛰고 나머지 내용은 계속 추출
+                    continue
+        table_content = "".join(table_parts)
+
+        # 이미지 정보 추출
+        image_count = len(page.get_images())
+        total_tables += table_count
+        total_images += image_count
+        image_content = ""
+        if image_count:
+            image_content = f"\n\n[이 페이지에는 {image_count}개의 이미지가 포함되어 있습니다]\n"
+
+        # 모든 내용 결합
+        combined_content = "\n\n".join((
+            f"페이지 {page_num} 내용:",
+            text,
+            table_content,
+            image_content,
+            f"구조화된 텍스트:\n{structured_text}",
+        ))
+
+        # Document 객체 생성
+        doc_obj = Document(
+            page_content=combined_content,
+            metadata={
+                "page": page_num,
+                "has_tables": table_count > 0,
+                "table_count": table_count,
+                "image_count": image_count,
+                "total_pages": total_pages
+            }
+        )
+        documents.append(doc_obj)
+
+    doc.close()
+    return documents, total_tables, total_images
+
+def load_pdf_documents(file_path):
+    """PDF에서 Document 목록을 추출합니다. (documents, 추출 방식, 표 수, 이미지 수)를 반환합니다."""
+    try:
+        # 고급 PDF 추출 시도
+        documents, total_tables, total_images = extract_pdf_content_advanced(file_path)
+        return documents, "고급 추출 (표, 이미지, 구조 포함)", total_tables, total_images
+    except Exception:
+        # 기본 PDF 로더로 폴백 (표/이미지 정보 없음)
+        loader = PyPDFLoader(file_path)
+        return loader.load(), "기본 추출", 0, 0